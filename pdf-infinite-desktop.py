@@ -21,6 +21,16 @@
 #  - Next/previous pages of a PDF with n/p or PgUp/PgDn
 #  - Duplicate a PDF with d
 #
+# With --recursive before the directory, every subdirectory becomes a region
+# of the desktop, and PDFs are only opened for regions near the view.
+#
+# Input can be recorded with --record (file) and played back against the
+# same directory with --replay (file), which reports frame times, time
+# until the view is sharp after each camera change, and peak memory.
+#
+# Thumbnails can be rendered ahead of time for a whole directory tree with
+# python pdf-infinite-desktop.py --prerender (PDF directory) [scale ...]
+#
 #
 # This was written sometime in 2009 as a proof-of-concept and was
 # ported to current Clutter (1.16) in 2013. I have not yet adapted the
@@ -29,16 +39,18 @@
 
 
 
-from gi.repository import Clutter, Poppler, Gtk, Gdk, GLib, Cogl
+from gi.repository import Clutter, Poppler, Gtk, Gdk, GdkPixbuf, GLib, Cogl
 import cairo
 import os
 import glob
 import threading
+import resource
 import Queue
 import pickle
 import math
 import weakref
 import sys
+from array import array
 from time import time
 from collections import defaultdict
 from collections import namedtuple
@@ -66,6 +78,22 @@ PAN_KEEP_INTERVAL = 30
 FREEING_STRATEGY = None # can be "aggressive"
 FULLSCREEN = False
 DIMENSIONS = (1280,800)
+SNAPSHOT_FADE_DURATION = 300
+CACHE_DIRNAME = ".pdf-desktop-cache"
+DISK_CACHE_SLACK = 2.0
+DISK_SCALE_UNITS = 1000 # scales on disk are kept in thousandths
+PRERENDER_SCALES = (DEFAULT_SCALE, 0.5, 1.0)
+NOMINAL_PAGE_SIZE = (612.0, 792.0)
+ENTITY_SPACING = 10.0
+REGION_SPACING = 400.0
+REGION_ROW_WIDTH = 40000.0
+REGION_LOAD_MARGIN = 1.0
+REGION_KEEP_MARGIN = 2.0
+INTERACTION_SETTLE = 0.25 # seconds, below SCALE_LOAD_TIMEOUT
+INTERACTIVE_RENDER_BUDGET = 0.05
+COST_SMOOTHING = 0.5
+COALESCE_SLACK = 1.25
+REPLAY_DRAIN_TIMEOUT = 10.0
 
 TextureInfo = namedtuple('TextureInfo', ['origscale', 'doc', 'pagenum'])
 CloneInfo = namedtuple('CloneInfo', ['origscale', 'doc', 'pagenum', 'time'])
@@ -79,13 +107,29 @@ def idle_add_once(func, *args):
 
     GLib.idle_add(wrapperfunc)
 
+def disk_scale(scale):
+    return int(round(scale * DISK_SCALE_UNITS)) / float(DISK_SCALE_UNITS)
+
+def disk_cache_name(name, pagenum, scale):
+    # no dots in the numbers, so parse_disk_cache_name reads it back even
+    # when the PDF name has some
+    return "%s.%d.%d.png" % (name, pagenum, int(round(scale * DISK_SCALE_UNITS)))
+
+def parse_disk_cache_name(fn):
+    fields = fn.rsplit(".", 3)
+    if len(fields) != 4: return None
+    name, pagenum, scale, ext = fields
+    if ext != "png" or not name or not pagenum.isdigit() or not scale.isdigit(): return None
+    return name, int(pagenum), int(scale) / float(DISK_SCALE_UNITS)
+
 class TextureManager(threading.Thread):
 
-    def __init__(self, desktop):
+    def __init__(self, desktop, diskcache = False, writecache = False, costfile = None):
         threading.Thread.__init__(self)
         self.requestslock = threading.Lock()
         self.requests = []
         self.requestsSets = []
+        self.queuedScales = defaultdict(lambda:[])
         self.tasks = threading.Semaphore(0)
         self.tasks.up = self.tasks.release
         self.tasks.down = self.tasks.acquire
@@ -99,9 +143,28 @@ class TextureManager(threading.Thread):
         self.cachelock = threading.Lock()
         self.cachetime = 0
 
+        # rendered pages in the cache directory next to each PDF:
+        # (pdf path, pagenum) -> {scale: mtime}
+        self.diskcache = diskcache
+        self.writecache = writecache
+        self.diskindex = defaultdict(lambda:dict())
+        self.scannedDirs = set()
+        self.docmtimes = dict()
+        self.droppedDocs = weakref.WeakSet()
+        self.byteswritten = 0
+        self.costfile = costfile
+
+        # measured render cost: (pdf filename, pagenum) -> seconds at scale 1.0
+        self.costs = dict()
+        self.load_costs()
+
         self.daemon = True
 
     def request_load_textures(self, requests, replaceable = False):
+        # entities sharing a page ask for the same texture; keep the first
+        seen = set()
+        requests = [ r for r in requests if not (r in seen or seen.add(r)) ]
+
         self.requestslock.acquire()
         islastrep = len(self.requests) > 0 and self.requests[-1][0]
         if islastrep and not replaceable:
@@ -110,9 +173,42 @@ class TextureManager(threading.Thread):
         else:
             self.requests.append( (replaceable, requests) )
             self.requestsSets.append( set(requests) )
+        for doc, pagenum, scale in requests:
+            self.queuedScales[doc, pagenum].append(scale)
         self.tasks.up()
         self.requestslock.release()
 
+    def unqueue(self, requests):
+        self.requestslock.acquire()
+        for doc, pagenum, scale in requests:
+            scales = self.queuedScales[doc, pagenum]
+            scales.remove(scale)
+            if not scales: del self.queuedScales[doc, pagenum]
+        self.requestslock.release()
+
+    def get_coalesced_request(self, doc, pagenum, scale):
+        # one render serves every queued request for the page that it is
+        # sharp enough for, so render at the largest scale in the slack
+        self.requestslock.acquire()
+        scales = [ s for s in self.queuedScales.get((doc, pagenum), []) if scale <= s <= scale * COALESCE_SLACK ]
+        self.requestslock.release()
+        return (doc, pagenum, max(scales + [scale]))
+
+    def is_satisfied(self, doc, pagenum, scale):
+        self.cachelock.acquire()
+        textures = self.cache.get(doc, {}).get(pagenum, [])
+        isit = any([ scale <= s <= scale * COALESCE_SLACK for s, _, _ in textures ])
+        self.cachelock.release()
+        return isit
+
+    def has_at_least(self, doc, pagenum, scale):
+        # any cached texture will do when it is at least this sharp
+        self.cachelock.acquire()
+        textures = self.cache.get(doc, {}).get(pagenum, [])
+        isit = any([ s >= scale for s, _, _ in textures ])
+        self.cachelock.release()
+        return isit
+
     def run(self):
         
         while True:
@@ -123,7 +219,7 @@ class TextureManager(threading.Thread):
             self.requestsSets.pop(0)
             self.requestslock.release()
 
-            for request in requests:
+            for i, request in enumerate(requests):
 
                 self.enable.down()
                 
@@ -132,44 +228,192 @@ class TextureManager(threading.Thread):
                     shouldbreak = len(self.requests) > 0 and request not in self.requestsSets[0] #!= requests and request
                     self.requestslock.release()
                     if shouldbreak:
+                        self.unqueue(requests[i:])
                         idle_add_once(self.enable.up)
                         break
 
-                self.cachelock.acquire()
-                isnecessary = request not in self.cacheUse
-                self.cachelock.release()
+                self.unqueue([request])
+                isnecessary = request[0] not in self.droppedDocs and not self.is_satisfied(*request)
+
+                # keep expensive pages cheap while the camera moves; the
+                # request made once it settles asks for the full scale again
+                degraded = False
+                if isnecessary and self.desktop.is_interacting():
+                    interactive = self.get_interactive_request(*request)
+                    degraded = interactive != request
+                    request = interactive
+                    if degraded: isnecessary = not self.has_at_least(*request)
+                    else: isnecessary = not self.is_satisfied(*request)
+                elif isnecessary:
+                    request = self.get_coalesced_request(*request)
 
                 if isnecessary:
-                    self.load_texture(*request)
+                    self.load_texture(*request, degraded = degraded)
                     idle_add_once(self.desktop.update)
                 
                 idle_add_once(self.enable.up)
 
-    def load_texture(self, doc, pagenum, scale):
+    def scan_disk_cache(self, cachedir):
+        # each cache directory is listed once, the first time one of its PDFs is loaded
+        if cachedir in self.scannedDirs: return
+        self.scannedDirs.add(cachedir)
+        if not os.path.isdir(cachedir): return
+        pdfdir = os.path.dirname(cachedir)
+        for fn in os.listdir(cachedir):
+            parsed = parse_disk_cache_name(fn)
+            if not parsed: continue
+            name, pagenum, scale = parsed
+            mtime = os.path.getmtime(os.path.join(cachedir, fn))
+            self.diskindex[os.path.join(pdfdir, name), pagenum][scale] = mtime
+
+    def get_doc_cachedir(self, doc):
+        return os.path.join(os.path.dirname(os.path.abspath(doc.filename)), CACHE_DIRNAME)
+
+    def disk_cache_path(self, doc, pagenum, scale):
+        name = os.path.basename(doc.filename)
+        return os.path.join(self.get_doc_cachedir(doc), disk_cache_name(name, pagenum, scale))
+
+    def get_doc_mtime(self, doc):
+        if doc not in self.docmtimes:
+            self.docmtimes[doc] = os.path.getmtime(doc.filename)
+        return self.docmtimes[doc]
+
+    def get_disk_scales(self, doc, pagenum):
+        # scales with an up to date rendering on disk
+        if not self.diskcache: return []
+        self.scan_disk_cache(self.get_doc_cachedir(doc))
+        docmtime = self.get_doc_mtime(doc)
+        entries = self.diskindex[os.path.abspath(doc.filename), pagenum]
+        return [ s for s, mtime in entries.items() if mtime >= docmtime ]
+
+    def is_uptodate_on_disk(self, doc, pagenum, scale):
+        return disk_scale(scale) in self.get_disk_scales(doc, pagenum)
+
+    def find_disk_scale(self, doc, pagenum, scale):
+        # smallest rendering on disk that is at least as sharp as requested
+        scales = [ s for s in self.get_disk_scales(doc, pagenum) if scale <= s <= scale * DISK_CACHE_SLACK ]
+        if not scales: return None
+        return min(scales)
+
+    def read_disk_texture(self, doc, pagenum, scale):
+        try:
+            return GdkPixbuf.Pixbuf.new_from_file(self.disk_cache_path(doc, pagenum, scale))
+        except Exception:
+            return None
 
-        page = doc.get_page(pagenum)
+    def write_disk_texture(self, doc, pagenum, scale, texture):
+        cachedir = self.get_doc_cachedir(doc)
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                if not os.path.isdir(cachedir): raise
+        path = self.disk_cache_path(doc, pagenum, scale)
+        texture.savev(path + ".tmp", "png", [], [])
+        os.rename(path + ".tmp", path)
+        self.diskindex[os.path.abspath(doc.filename), pagenum][disk_scale(scale)] = os.path.getmtime(path)
+        self.byteswritten += os.path.getsize(path)
+
+    def drop_textures(self, doc, pagenum):
+        self.cachelock.acquire()
+        for scale, txtr, _ in self.cache[doc].pop(pagenum, []):
+            del self.cacheUse[doc, pagenum, scale]
+            del txtr
+        self.cachelock.release()
 
-        w, h = page.get_size()
-        w *= scale
-        h *= scale
+    def load_costs(self):
+        if not self.costfile: return
+        # the costs are only a hint, so a missing or damaged file means no costs
+        try:
+            f = open(self.costfile, "r")
+            self.costs = pickle.load(f)
+            f.close()
+        except Exception:
+            self.costs = dict()
 
-        w = int(w)
-        h = int(h)
-        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, w, h)
-        context = cairo.Context(surface)
+    def save_costs(self):
+        if not self.costfile or not self.costs: return
+        if not os.path.isdir(os.path.dirname(self.costfile)): os.makedirs(os.path.dirname(self.costfile))
+        self.cachelock.acquire()
+        costs = dict(self.costs)
+        self.cachelock.release()
+        f = open(self.costfile + ".tmp", "w")
+        pickle.dump(costs, f)
+        f.close()
+        os.rename(self.costfile + ".tmp", self.costfile)
 
-        context.set_source_rgb(1,1,1)
-        context.rectangle(0,0,w,h)
-        context.fill()
-        context.scale(scale,scale)
-        page.render(context)
+    def record_cost(self, doc, pagenum, scale, elapsed):
+        cost = elapsed / (scale * scale)
+        self.cachelock.acquire()
+        old = self.costs.get((doc.filename, pagenum))
+        if old != None: cost = COST_SMOOTHING * old + (1.0 - COST_SMOOTHING) * cost
+        self.costs[doc.filename, pagenum] = cost
+        self.cachelock.release()
+
+    def predict_cost(self, doc, pagenum, scale):
+        self.cachelock.acquire()
+        cost = self.costs.get((doc.filename, pagenum))
+        self.cachelock.release()
+        if cost == None: return None
+        return cost * scale * scale
+
+    def get_interactive_request(self, doc, pagenum, scale):
+        # render time grows with the area, so shrink the scale until the
+        # predicted time fits the budget; degraded scales are snapped to
+        # doublings of DEFAULT_SCALE so that repeated interactions reuse
+        # the same few textures
+        predicted = self.predict_cost(doc, pagenum, scale)
+        if predicted == None or predicted <= INTERACTIVE_RENDER_BUDGET:
+            return (doc, pagenum, scale)
+        fitted = scale * math.sqrt(INTERACTIVE_RENDER_BUDGET / predicted)
+        if fitted <= DEFAULT_SCALE:
+            return (doc, pagenum, min(scale, DEFAULT_SCALE))
+        return (doc, pagenum, DEFAULT_SCALE * 2 ** math.floor(math.log(fitted / DEFAULT_SCALE, 2)))
+
+    def drop_document(self, doc):
+        self.cachelock.acquire()
+        for pagenum, textures in self.cache.pop(doc, {}).items():
+            for scale, txtr, _ in textures:
+                del self.cacheUse[doc, pagenum, scale]
+                del txtr
+        self.docmtimes.pop(doc, None)
+        self.droppedDocs.add(doc)
+        self.cachelock.release()
+
+    def load_texture(self, doc, pagenum, scale, degraded = False):
+
+        texture = None
+        diskscale = None
+        if not self.writecache:
+            diskscale = self.find_disk_scale(doc, pagenum, scale)
+        if diskscale != None:
+            self.cachelock.acquire()
+            loaded = (doc, pagenum, diskscale) in self.cacheUse
+            self.cachelock.release()
+            if loaded: return
+            texture = self.read_disk_texture(doc, pagenum, diskscale)
+            if texture != None: scale = diskscale
+        if texture == None:
+            start = time()
+            texture = self.render_texture(doc, pagenum, scale)
+            self.record_cost(doc, pagenum, scale, time() - start)
+            if self.writecache:
+                self.write_disk_texture(doc, pagenum, scale, texture)
 
-        texture = Gdk.pixbuf_get_from_surface(context.get_target(), 0, 0, w, h)
         textureinfo = TextureInfo(origscale = scale, doc = doc, pagenum = pagenum)
 
         self.cachelock.acquire()
+        if doc in self.droppedDocs:
+            # the region was dematerialized while this was rendering
+            self.cachelock.release()
+            return
+
         if len(self.cache[doc][pagenum]) >= MAX_TEXTURES_KEEP:
-            _, txtr, txtrinfo = self.cache[doc][pagenum].pop(0)
+            # the list is sharpest first; a degraded render must not push
+            # out the sharp texture that is wanted back once the camera settles
+            if degraded: evict = 1
+            else: evict = 0
+            _, txtr, txtrinfo = self.cache[doc][pagenum].pop(evict)
             del self.cacheUse[doc, pagenum, txtrinfo.origscale]
             del txtr
 
@@ -183,8 +427,29 @@ class TextureManager(threading.Thread):
         self.cachetime = time()
         
         self.cachelock.release()
+
+    def render_texture(self, doc, pagenum, scale):
+
+        page = doc.get_page(pagenum)
+
+        w, h = page.get_size()
+        w *= scale
+        h *= scale
+
+        w = int(w)
+        h = int(h)
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, w, h)
+        context = cairo.Context(surface)
+
+        context.set_source_rgb(1,1,1)
+        context.rectangle(0,0,w,h)
+        context.fill()
+        context.scale(scale,scale)
+        page.render(context)
+
+        return Gdk.pixbuf_get_from_surface(context.get_target(), 0, 0, w, h)
             
-    def get_texture(self, doc, pagenum, reqscale):
+    def get_pixbuf(self, doc, pagenum, reqscale):
 
         texture = None
         textureinfo = None
@@ -201,6 +466,12 @@ class TextureManager(threading.Thread):
         readtime = time()
         self.cachelock.release()
 
+        return texture, textureinfo, readtime
+
+    def get_texture(self, doc, pagenum, reqscale):
+
+        texture, textureinfo, readtime = self.get_pixbuf(doc, pagenum, reqscale)
+
         if texture: 
             image = Clutter.Image()
             image.set_data(texture.get_pixels(),
@@ -333,15 +604,19 @@ class Camera:
         self.y = my - self.vheight / (2.0 * self.scale)
         
 
-class PdfEntity:
+class PdfEntity(object):
+
+    # geometry lives in the Space arrays; an entity only knows its slot
+    __slots__ = ('desktop', 'doc', 'pagenum', 'index', 'region',
+                 'texture', 'textureinfo', 'texturescale', 'texturepage', 'texturetime')
 
     def __init__(self, desktop, doc, pagenum):
 
-        self.pagenum = pagenum
         self.desktop = desktop
         self.doc = doc
         self.pagenum = pagenum
-        self.page = doc.get_page(pagenum)
+        self.index = None
+        self.region = None
         self.texture = None
         self.textureinfo = None
         self.texturescale = 0
@@ -353,9 +628,12 @@ class PdfEntity:
         newpage = self.pagenum + add
         if newpage < 0 or newpage >= self.doc.get_n_pages(): return False
         self.pagenum = newpage
-        self.page = self.doc.get_page(newpage)
+        self.desktop.space.set_size(self, self.get_page_size())
         return True
 
+    def get_page_size(self):
+        return self.doc.get_page(self.pagenum).get_size()
+
     def get_title(self):
         fn = self.doc.filename.split("/")[-1]
         fn = fn.split(".")[0]
@@ -363,9 +641,8 @@ class PdfEntity:
         fn = fields[0] + " : " + " ".join(fields[1:])
         return fn
         
-    def update(self):
+    def update(self, visible = None):
 
-        w, h = self.page.get_size()
         x, y = self.desktop.space.get_pos(self)
         
         camera = self.desktop.camera
@@ -374,7 +651,9 @@ class PdfEntity:
         textureinfo = None
         canvas = None
 
-        if camera.in_bounds(x,y,w,h):
+        if visible == None: visible = self.is_visible()
+
+        if visible:
             if self.texture == None or (not texturemgr.is_uptodate_texture(self.texturetime)) or self.texturescale != camera.scale or self.texturepage != self.pagenum:
                 result = texturemgr.get_texture(self.doc, self.pagenum, camera.scale)
             else:
@@ -389,6 +668,7 @@ class PdfEntity:
                 self.texturescale = textureinfo.origscale
 
         if texture != self.texture:
+            fadein = self.texture == None and self.desktop.snapshot != None
             if self.texture:
                 self.texture.hide()
                 self.desktop.stage.remove_actor(self.texture)
@@ -399,37 +679,32 @@ class PdfEntity:
             if texture:
                 self.desktop.stage.add_actor(texture)
                 texture.show()
+                if fadein: self.desktop.fade_in(texture)
 
     def is_visible(self):
-        w, h = self.page.get_size()
         x, y = self.desktop.space.get_pos(self)
+        w, h = self.desktop.space.get_size(self)
         return self.desktop.camera.in_bounds(x,y,w,h)
 
     def get_bounds(self):
         x, y = self.desktop.space.get_pos(self)
-        w, h = self.page.get_size()
+        w, h = self.desktop.space.get_size(self)
         return (x, y, x + w, y + h)
 
     def get_size(self):
-        return self.page.get_size()
-
-    def get_cameradist_metric(self):
-        x,y = self.desktop.space.get_pos(self)
-        w,h = self.get_size()
-        mx, my = x+w/2.0, y+h/2.0
-        cx,cy,cw,ch = self.desktop.camera.get_bounds()
-        cmx, cmy = cx+cw/2.0, cy+ch/2.0
-        return math.hypot(cmx-mx, cmy-my)
+        return self.desktop.space.get_size(self)
 
     def delete(self):
         if self.texture:
             self.texture.hide()
             self.desktop.stage.remove_actor(self.texture)
-            self.desktop.texturemgr.release_texture(self.texture)
+            self.desktop.texturemgr.release_texture(self.texture, self.textureinfo)
+            self.texture = None
+            self.textureinfo = None
 
 class Desktop:
 
-    def __init__(self, directory):
+    def __init__(self, directory, recursive = False, record = None, replay = None):
 
         self.space = None
         self.active_entity = None
@@ -442,9 +717,24 @@ class Desktop:
         self.label = None
         self.show_tooltip = True
         self.directory = directory
-
-        # set up texture cache
-        self.texturemgr = TextureManager(self)
+        self.snapshot = None
+        self.regions = None
+        self.materialized = dict()
+        self.regionbounds = None
+        self.lastviewchange = 0
+        self.recorder = None
+        self.session = None
+        if recursive: self.regions = RegionIndex(directory)
+        if record: self.recorder = SessionRecorder(record)
+        if replay: self.session = SessionReplay(self, replay)
+
+        # set up texture cache; a replay always renders, so that
+        # builds are compared on the same work
+        if self.session:
+            self.texturemgr = TextureManager(self)
+        else:
+            self.texturemgr = TextureManager(self, diskcache = True,
+                                             costfile = os.path.join(directory, CACHE_DIRNAME, "costs"))
         
         # set up stage
 
@@ -460,11 +750,6 @@ class Desktop:
             stage.set_color(c)
             self.background = None
 
-        stage.connect('scroll-event', self.on_zoom_event)
-        stage.connect('button-press-event', self.on_mouse_press_event)
-        stage.connect('button-release-event', self.on_mouse_release_event)
-        stage.connect('motion-event', self.on_motion_event)
-        stage.connect('key-press-event', self.on_key_press_event)
         stage.connect('fullscreen', self.on_resize)
         stage.connect('unfullscreen', self.on_resize)
         stage.connect('delete-event', self.on_quit)
@@ -472,41 +757,91 @@ class Desktop:
         self.stage = stage
         self.stage.show_all()
 
-        g = glob.glob(os.path.join(directory, "*.pdf"))
-
         try:
-            f = open(os.path.join(directory, ".pdf-desktop-config"), "r")
-            camerascale, camerax, cameray, config = pickle.load(f)
-            f.close()
-            existing = set(list(g))
-            config = filter(lambda (fn, pg, pos, size) : fn in existing, config)
-            fns = set([fn for (fn, _, _, _) in config ])
-            for fn in existing - fns:
-                config.append( (fn,0,None,None) )
+            if self.session:
+                camerascale, camerax, cameray, config = self.session.get_initial_state(directory)
+            elif self.regions != None:
+                camerascale, camerax, cameray = self.regions.read()
+                config = None
+            else:
+                f = open(os.path.join(directory, ".pdf-desktop-config"), "r")
+                camerascale, camerax, cameray, config = pickle.load(f)
+                f.close()
         except IOError:
             camerascale = DEFAULT_SCALE
             camerax = 0.0
             cameray = 0.0
-            config = [ (fn, 0, None, None) for fn in g ]
+            config = None
 
         # set up camera
         camera = Camera(stage, camerascale, camerax, cameray)
         self.camera = camera
 
-        # set up docs
-        fns = set([fn for (fn,_,_,_) in config])
-        docs = dict([(fn, Poppler.Document.new_from_file("file://" + fn, None)) for fn in fns])
-        for (fn, doc) in docs.items(): doc.filename = fn
+        # show last session's view until the real textures come in;
+        # documents are only opened once the stage has had a chance to paint
+        if not self.session: self.load_snapshot()
+        idle_add_once(self.load_space, config)
+
+        if FULLSCREEN: self.stage.set_fullscreen(True)
+
+    def load_space(self, config):
 
-        # set up space
-        space = Space(self)
+        self.space = Space(self)
+
+        if self.regions != None:
+            self.regions.load()
+            self.update_regions()
+        else:
+            directory = self.directory
+            g = glob.glob(os.path.join(directory, "*.pdf"))
+
+            if config != None:
+                existing = set(list(g))
+                config = filter(lambda (fn, pg, pos, size) : fn in existing, config)
+                fns = set([fn for (fn, _, _, _) in config ])
+                for fn in existing - fns:
+                    config.append( (fn,0,None,None) )
+            else:
+                config = [ (fn, 0, None, None) for fn in g ]
+
+            self.add_entities(config)
+            self.request_textures(self.space.get_entities_sorted())
+
+        stage = self.stage
+        stage.connect('scroll-event', self.on_zoom_event)
+        stage.connect('button-press-event', self.on_mouse_press_event)
+        stage.connect('button-release-event', self.on_mouse_release_event)
+        stage.connect('motion-event', self.on_motion_event)
+        stage.connect('key-press-event', self.on_key_press_event)
+
+        self.update()
+
+        if self.recorder: self.recorder.start(self)
+        if self.session: self.session.start()
+
+    def open_documents(self, config):
+        docs = dict()
+        for fn in set([fn for (fn,_,_,_) in config]):
+            try:
+                docs[fn] = Poppler.Document.new_from_file("file://" + os.path.abspath(fn), None)
+                docs[fn].filename = fn
+            except Exception, e:
+                sys.stderr.write("%s: %s\n" % (fn, e))
+        return docs
+
+    def add_entities(self, config, region = None):
+        docs = self.open_documents(config)
+        entities = []
         for (fn, pg, pos, _) in config:
+            if fn not in docs: continue
             entity = PdfEntity(self, docs[fn], pg)
-            space.add(entity, pos)
-        self.space = space
+            entity.region = region
+            self.space.add(entity, pos)
+            entities.append(entity)
+        return entities
+
+    def request_textures(self, entities):
 
-        # init requests
-        entities = self.space.get_entities_sorted()
         requests = defaultdict(lambda:[])
 
         for entity, (pos, size) in entities:
@@ -527,9 +862,133 @@ class Desktop:
 
         self.texturemgr.request_load_textures(requestlist)
 
-        self.update()
+    def update_regions(self):
+
+        # open the regions around the view, and close the ones the
+        # camera has moved well away from
+        bounds = self.camera.get_bounds()
+        if bounds == self.regionbounds: return
+        self.regionbounds = bounds
+
+        x, y, ex, ey = bounds
+        mw, mh = ex - x, ey - y
+        near = self.regions.get_intersecting(x - mw * REGION_LOAD_MARGIN, y - mh * REGION_LOAD_MARGIN,
+                                             ex + mw * REGION_LOAD_MARGIN, ey + mh * REGION_LOAD_MARGIN)
+        keep = set(self.regions.get_intersecting(x - mw * REGION_KEEP_MARGIN, y - mh * REGION_KEEP_MARGIN,
+                                                 ex + mw * REGION_KEEP_MARGIN, ey + mh * REGION_KEEP_MARGIN))
+
+        for region in self.materialized.keys():
+            if region not in keep:
+                self.dematerialize(region)
+
+        entities = []
+        for region in near:
+            if region not in self.materialized:
+                self.materialized[region] = self.add_entities(self.regions.configs[region], region)
+                entities.extend(self.materialized[region])
+
+        if entities:
+            new = set(entities)
+            self.request_textures([ (ent, geometry) for ent, geometry in self.space.get_entities_sorted() if ent in new ])
+
+    def get_region_config(self, region):
+        return [ (ent.doc.filename, ent.pagenum, self.space.get_pos(ent), self.space.get_size(ent))
+                 for ent in self.materialized[region] ]
+
+    def dematerialize(self, region):
+        self.regions.set_config(region, self.get_region_config(region))
+        entities = self.materialized.pop(region)
+        for entity in entities:
+            if entity == self.selected_entity: self.selected_entity = None
+            if entity == self.active_entity: self.active_entity = None
+            self.space.remove(entity)
+        for doc in set([ entity.doc for entity in entities ]):
+            self.texturemgr.drop_document(doc)
 
-        if FULLSCREEN: self.stage.set_fullscreen(True)
+    def get_bounds(self):
+        if self.regions != None: return self.regions.get_bounds()
+        return self.space.get_bounds()
+
+    def load_snapshot(self):
+        try:
+            f = open(os.path.join(self.directory, ".pdf-desktop-snapshot"), "r")
+            self.snapshotview = pickle.load(f)
+            f.close()
+            snapshot = Clutter.Texture.new_from_file(os.path.join(self.directory, ".pdf-desktop-snapshot.png"))
+        except Exception:
+            return
+        self.snapshot = snapshot
+        self.snapshotopacity = 255
+        self.stage.add_actor(snapshot)
+        self.update_snapshot()
+        snapshot.show()
+
+    def update_snapshot(self):
+
+        if not self.snapshot: return
+
+        # the snapshot is pinned to the part of the plane it was taken of
+        scale, x, y = self.snapshotview
+        factor = self.camera.scale / scale
+        self.snapshot.set_scale(factor, factor)
+        self.snapshot.set_position(*self.camera.translate_to_view(x, y))
+
+        if self.space is None: return
+
+        visible = self.space.get_visible_entities()
+        if len(visible) == 0: return
+        pending = len([ ent for ent in visible if ent.texture == None ])
+        opacity = int(255 * pending / len(visible))
+        if opacity == self.snapshotopacity: return
+        self.snapshotopacity = opacity
+
+        self.snapshot.save_easing_state()
+        self.snapshot.set_easing_duration(SNAPSHOT_FADE_DURATION)
+        self.snapshot.set_opacity(opacity)
+        self.snapshot.restore_easing_state()
+        if opacity == 0:
+            self.snapshot.connect('transitions-completed', self.on_snapshot_faded)
+
+    def on_snapshot_faded(self, actor):
+        if self.snapshot == actor:
+            self.stage.remove_actor(actor)
+            self.snapshot = None
+
+    def fade_in(self, actor):
+        actor.set_opacity(0)
+        actor.save_easing_state()
+        actor.set_easing_duration(SNAPSHOT_FADE_DURATION)
+        actor.set_opacity(255)
+        actor.restore_easing_state()
+
+    def save_snapshot(self):
+
+        # composite the visible entities from the texture cache, the same
+        # way Space.update stacks them on the stage
+        w, h = int(self.camera.vwidth), int(self.camera.vheight)
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        context = cairo.Context(surface)
+
+        visible = self.space.get_visible_entities()
+        if self.selected_entity in visible:
+            visible.remove(self.selected_entity)
+            visible.append(self.selected_entity)
+
+        for entity in visible:
+            texture, textureinfo, _ = self.texturemgr.get_pixbuf(entity.doc, entity.pagenum, self.camera.scale)
+            if not texture: continue
+            factor = self.camera.scale / textureinfo.origscale
+            context.save()
+            context.translate(*self.camera.translate_to_view(*self.space.get_pos(entity)))
+            context.scale(factor, factor)
+            Gdk.cairo_set_source_pixbuf(context, texture, 0, 0)
+            context.paint()
+            context.restore()
+
+        surface.write_to_png(os.path.join(self.directory, ".pdf-desktop-snapshot.png"))
+        f = open(os.path.join(self.directory, ".pdf-desktop-snapshot"), "w")
+        pickle.dump( (self.camera.scale, self.camera.x, self.camera.y), f)
+        f.close()
 
     def stretch_background(self):
         if self.background:
@@ -538,16 +997,25 @@ class Desktop:
             self.background.set_scale(sw/float(w), sh/float(h))
 
     def update(self):
-        if self.space:
+        if self.space is not None:
+            if self.session: self.session.on_work()
+            if self.regions != None: self.update_regions()
             self.space.update()
+            self.update_snapshot()
             self.stage.show_all()
+            if self.session: self.session.on_update()
 
     def updated_view(self, cancel_timeouts = True):
+        self.lastviewchange = time()
+        if self.session: self.session.on_view_change()
         if self.timeout and cancel_timeouts:
             GLib.source_remove(self.timeout)
         self.timeout = GLib.timeout_add(SCALE_LOAD_TIMEOUT, self.schedule_load_textures_for_scale)
         
 
+    def is_interacting(self):
+        return time() - self.lastviewchange < INTERACTION_SETTLE
+
     def schedule_load_textures_for_scale(self):
 
         if self.camera.scale >= MIN_LOAD_SCALE: scale = self.camera.scale
@@ -649,7 +1117,7 @@ class Desktop:
                 self.pantimeout = None
 
         if event.keyval == Clutter.KEY_Home:
-            self.camera.handle_zoom_box(self.space.get_bounds())
+            self.camera.handle_zoom_box(self.get_bounds())
             self.update()
             self.updated_view()
 
@@ -686,6 +1154,8 @@ class Desktop:
             entity = PdfEntity(self, oldent.doc, oldent.pagenum)
             x, y = self.camera.translate_from_view(self.lastMouseX, self.lastMouseY)
             self.space.add(entity, (x,y))
+            entity.region = oldent.region
+            if entity.region != None: self.materialized[entity.region].append(entity)
             self.selected_entity = entity
             self.active_entity = entity
             self.dispx = 0
@@ -694,6 +1164,8 @@ class Desktop:
 
         if event.keyval == Clutter.KEY_Delete:
             if self.space.remove_entity(self.selected_entity):
+                if self.selected_entity.region != None:
+                    self.materialized[self.selected_entity.region].remove(self.selected_entity)
                 self.selected_entity = None
                 self.active_entity = None
                 self.update()
@@ -704,12 +1176,30 @@ class Desktop:
             self.updated_view()
 
     def on_quit(self, *args):
-        self.save_config()
+        if self.recorder:
+            self.recorder.save()
+        # a replay leaves the user's layout, snapshot and costs untouched
+        if self.space is not None and not self.session:
+            self.save_config()
+            try:
+                self.save_snapshot()
+            except Exception, e:
+                sys.stderr.write("could not save snapshot: %s\n" % e)
+            try:
+                self.texturemgr.save_costs()
+            except Exception, e:
+                sys.stderr.write("could not save render costs: %s\n" % e)
         Clutter.main_quit()
         
         exit(0)
 
     def save_config(self):
+        if self.regions != None:
+            # the flat layout in .pdf-desktop-config is left alone
+            for region in self.materialized:
+                self.regions.set_config(region, self.get_region_config(region))
+            self.regions.save( (self.camera.scale, self.camera.x, self.camera.y) )
+            return
         config = self.space.get_config()
         f = open(os.path.join(self.directory, ".pdf-desktop-config"), "w")
         pickle.dump( (self.camera.scale, self.camera.x, self.camera.y, config), f)
@@ -734,88 +1224,455 @@ class Desktop:
         
 class Space:
 
+    # struct-of-arrays: slot i of xs/ys/ws/hs holds the geometry of
+    # entities[i]; removal swaps the last slot into the hole
+
     def __init__(self, desktop):
         self.desktop = desktop
-        self.entities_dict = {}
+        self.entities = []
+        self.xs = array('d')
+        self.ys = array('d')
+        self.ws = array('d')
+        self.hs = array('d')
+
+    def __len__(self):
+        return len(self.entities)
 
     def update(self):
         # render selected entity last
-        for key in self.entities_dict:
-            if key != self.desktop.selected_entity:
-                key.update()
-        if self.desktop.selected_entity:
-            selected = self.desktop.selected_entity
-            selected.update()
+        selected = self.desktop.selected_entity
+        mask = self.get_visible_mask()
+        for entity, visible in zip(self.entities, mask):
+            if entity != selected:
+                entity.update(visible)
+        if selected:
+            selected.update(mask[selected.index])
             
     def add(self, entity, pos = None):
 
-        w, h = entity.get_size()
+        w, h = entity.get_page_size()
         if pos == None:
-            xs, ys = [], []
-            for npos, nsize in self.entities_dict.values():
-                if npos != None and nsize != None:
-                    nx,ny = npos
-                    nw,nh = nsize
-                    xs.append(nx+nw)
-                    ys.append(ny+nh)
-            if xs != []:
-                x, y = max(xs)+10.0, 10.0
+            if self.entities:
+                x, y = max([ x+w for x, w in zip(self.xs, self.ws) ])+10.0, 10.0
             else:
                 x, y = 10.0, 10.0
-            self.entities_dict[entity] = ((x,y), (w,h))
         else:
-            self.entities_dict[entity] = (pos, (w,h))
+            x, y = pos
+        entity.index = len(self.entities)
+        self.entities.append(entity)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.ws.append(w)
+        self.hs.append(h)
 
     def get_pos(self, entity):
-        return self.entities_dict[entity][0]
+        i = entity.index
+        return (self.xs[i], self.ys[i])
 
     def set_pos(self, entity, newpos):
-        pos, size = self.entities_dict[entity]
-        self.entities_dict[entity] = newpos, size
+        i = entity.index
+        self.xs[i], self.ys[i] = newpos
+
+    def get_size(self, entity):
+        i = entity.index
+        return (self.ws[i], self.hs[i])
+
+    def set_size(self, entity, newsize):
+        i = entity.index
+        self.ws[i], self.hs[i] = newsize
 
     def get_bounds(self):
-        startx = [ x for (x,y), (w,h) in self.entities_dict.values() ]
-        starty = [ y for (x,y), (w,h) in self.entities_dict.values() ]
-        endx = [ x+w for (x,y), (w,h) in self.entities_dict.values() ]
-        endy = [ y+h for (x,y), (w,h) in self.entities_dict.values() ]
-        return (min(startx), min(starty), max(endx), max(endy))
+        return (min(self.xs), min(self.ys),
+                max([ x+w for x, w in zip(self.xs, self.ws) ]),
+                max([ y+h for y, h in zip(self.ys, self.hs) ]))
+
+    def get_visible_mask(self):
+        # same test as Camera.in_bounds, done in world coordinates for all slots at once
+        cx, cy, cex, cey = self.desktop.camera.get_bounds()
+        return [ x < cex and x+w > cx and y < cey and y+h > cy
+                 for x, y, w, h in zip(self.xs, self.ys, self.ws, self.hs) ]
 
     def get_visible_entities(self):
-        return [ ent for ent in self.entities_dict.keys() if ent.is_visible() ]
+        return [ ent for ent, visible in zip(self.entities, self.get_visible_mask()) if visible ]
+
+    def get_cameradist_metrics(self):
+        # squared distance between entity and camera centers; only used for ordering
+        cx, cy, cex, cey = self.desktop.camera.get_bounds()
+        cmx, cmy = (cx+cex)/2.0, (cy+cey)/2.0
+        return [ (x+w/2.0-cmx)**2 + (y+h/2.0-cmy)**2
+                 for x, y, w, h in zip(self.xs, self.ys, self.ws, self.hs) ]
 
     def get_entities_sorted(self):
-        s = self.entities_dict.items()
-        s.sort(key = lambda (entity, (pos, size)) : entity.get_cameradist_metric())
-        return s
+        metrics = self.get_cameradist_metrics()
+        order = sorted(xrange(len(self.entities)), key = metrics.__getitem__)
+        return [ (self.entities[i], ((self.xs[i], self.ys[i]), (self.ws[i], self.hs[i]))) for i in order ]
 
     def get_config(self):
-        config = [ (entity.doc.filename, entity.pagenum, pos, size) for entity, (pos, size) in self.entities_dict.items() ]
+        config = [ (entity.doc.filename, entity.pagenum, (x, y), (w, h))
+                   for entity, x, y, w, h in zip(self.entities, self.xs, self.ys, self.ws, self.hs) ]
         return config
 
     def remove_entity(self, ent):
 
         times = 0
-        for entity in self.entities_dict.keys():
+        for entity in self.entities:
             if entity.doc == ent.doc: times += 1
             
         if times > 1:
-            ent.delete()
-            del self.entities_dict[ent]
+            self.remove(ent)
             return True
         
         return False
 
+    def remove(self, ent):
+        ent.delete()
+        i, last = ent.index, len(self.entities) - 1
+        moved = self.entities[last]
+        self.entities[i] = moved
+        moved.index = i
+        for arr in (self.xs, self.ys, self.ws, self.hs):
+            arr[i] = arr[last]
+            arr.pop()
+        self.entities.pop()
+        ent.index = None
+
+class SessionRecorder:
+
+    # logs the input events reaching the stage, with times relative to
+    # when the space was ready, and the state the session started from
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.initial = None
+        self.events = []
+        self.starttime = 0
+
+    def start(self, desktop):
+        camera = desktop.camera
+        config = [ (os.path.relpath(fn, desktop.directory), pg, pos, size)
+                   for (fn, pg, pos, size) in desktop.space.get_config() ]
+        self.initial = (camera.scale, camera.x, camera.y, config)
+        self.starttime = time()
+        desktop.stage.connect('captured-event', self.on_event)
+
+    def on_event(self, stage, event):
+        # captured-event hands over a generic ClutterEvent, so go through
+        # the accessors rather than the fields the typed signals expose
+        t = time() - self.starttime
+        kind = event.type()
+        x, y = event.get_coords()
+        if kind == Clutter.EventType.SCROLL:
+            self.events.append( (t, 'scroll', dict(direction = int(event.get_scroll_direction()), x = x, y = y)) )
+        elif kind == Clutter.EventType.MOTION:
+            self.events.append( (t, 'motion', dict(x = x, y = y)) )
+        elif kind == Clutter.EventType.BUTTON_PRESS:
+            self.events.append( (t, 'press', dict(button = event.get_button(), x = x, y = y)) )
+        elif kind == Clutter.EventType.BUTTON_RELEASE:
+            self.events.append( (t, 'release', dict(button = event.get_button(), x = x, y = y)) )
+        elif kind == Clutter.EventType.KEY_PRESS and event.get_key_symbol() != Clutter.KEY_Escape:
+            self.events.append( (t, 'key', dict(keyval = event.get_key_symbol())) )
+        return False
+
+    def save(self):
+        events = self.events + [ (time() - self.starttime, 'end', dict()) ]
+        f = open(self.filename, "w")
+        pickle.dump( (self.initial, events), f)
+        f.close()
+
+class ReplayEvent(object):
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class SessionReplay:
+
+    # feeds a recorded session into the desktop handlers on the recorded
+    # schedule and measures how the build keeps up with it
+
+    def __init__(self, desktop, filename):
+        self.desktop = desktop
+        f = open(filename, "r")
+        self.initial, self.events = pickle.load(f)
+        f.close()
+        self.handlers = { 'scroll': desktop.on_zoom_event,
+                          'motion': desktop.on_motion_event,
+                          'press': desktop.on_mouse_press_event,
+                          'release': desktop.on_mouse_release_event,
+                          'key': desktop.on_key_press_event }
+        self.frametimes = []
+        self.pendingsince = None
+        self.sharptimes = []
+        self.unresolved = 0
+        self.viewchange = None
+        self.starttime = 0
+        self.endtime = 0
+
+    def get_initial_state(self, directory):
+        scale, x, y, config = self.initial
+        config = [ (os.path.join(directory, fn), pg, pos, size) for (fn, pg, pos, size) in config ]
+        return scale, x, y, config
+
+    def start(self):
+        self.starttime = time()
+        Clutter.threads_add_repaint_func_full(Clutter.RepaintFlags.POST_PAINT, self.on_repaint, None)
+        for t, kind, fields in self.events:
+            GLib.timeout_add(int(t * 1000), self.dispatch, kind, fields)
+        # the first load counts as a view change too
+        self.on_view_change()
+        self.on_update()
+
+    def dispatch(self, kind, fields):
+        if kind == 'end':
+            self.endtime = time()
+            GLib.timeout_add(100, self.drain)
+        else:
+            self.on_work()
+            self.handlers[kind](self.desktop.stage, ReplayEvent(**fields))
+        return False
+
+    def drain(self):
+        if self.viewchange != None and time() - self.endtime < REPLAY_DRAIN_TIMEOUT:
+            return True
+        self.report()
+        Clutter.main_quit()
+        return False
+
+    def on_work(self):
+        # input or an update is waiting for the next frame
+        if self.pendingsince == None: self.pendingsince = time()
+
+    def on_repaint(self, *args):
+        # a frame takes from the first work it shows until it is painted,
+        # so a stall in a handler or in the paint itself counts in full;
+        # repaints with nothing pending are the stage idling
+        if self.pendingsince != None:
+            self.frametimes.append(time() - self.pendingsince)
+            self.pendingsince = None
+        return True
+
+    def on_view_change(self):
+        if self.viewchange != None: self.unresolved += 1
+        self.viewchange = time()
+
+    def on_update(self):
+        # sharp: every visible entity shows a texture at the scale that
+        # schedule_load_textures_for_scale would ask for
+        if self.viewchange == None: return
+        camera = self.desktop.camera
+        if camera.scale >= MIN_LOAD_SCALE: scale = camera.scale
+        else: scale = DEFAULT_SCALE
+        for entity in self.desktop.space.get_visible_entities():
+            if entity.texture == None or entity.texturescale < scale: return
+        self.sharptimes.append(time() - self.viewchange)
+        self.viewchange = None
+
+    def report(self):
+
+        def percentiles(values):
+            values = sorted(values)
+            if not values: return "n/a"
+            pick = lambda p : values[int(p * (len(values) - 1))] * 1000.0
+            return "p50 %.1fms  p90 %.1fms  p99 %.1fms  max %.1fms" % (pick(0.5), pick(0.9), pick(0.99), pick(1.0))
+
+        print "frames:        %d  %s" % (len(self.frametimes), percentiles(self.frametimes))
+        print "time to sharp: %d  %s  (%d superseded, %s at end)" % \
+            (len(self.sharptimes), percentiles(self.sharptimes), self.unresolved,
+             "not sharp" if self.viewchange != None else "sharp")
+        print "peak memory:   %.1f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+class RegionIndex:
+
+    # one region per directory of the tree, kept as bounds in parallel
+    # arrays plus the saved entity layout; Desktop only materializes
+    # entities for the regions near the camera
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.saved = []
+        self.paths = []
+        self.configs = []
+        self.xs = array('d')
+        self.ys = array('d')
+        self.ws = array('d')
+        self.hs = array('d')
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, path, config, (x, y, w, h)):
+        self.paths.append(path)
+        self.configs.append(config)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.ws.append(w)
+        self.hs.append(h)
+
+    def read(self):
+        # the saved layout and the camera, which is returned; the
+        # directory tree is only walked in load
+        f = open(os.path.join(self.root, ".pdf-desktop-index"), "r")
+        camera, self.saved = pickle.load(f)
+        f.close()
+        return camera
+
+    def load(self):
+
+        old = dict([ (path, (config, bounds)) for (path, config, bounds) in self.saved ])
+
+        found = []
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = sorted([ d for d in dirs if not d.startswith(".") ])
+            pdfs = sorted([ os.path.join(root, fn) for fn in files if fn.endswith(".pdf") ])
+            if pdfs: found.append( (root, pdfs) )
+
+        # keep the layout of known directories, appending new files below it
+        newdirs = []
+        for path, pdfs in found:
+            if path not in old:
+                newdirs.append( (path, pdfs) )
+                continue
+            config, (x, y, w, h) = old[path]
+            existing = set(pdfs)
+            config = filter(lambda (fn, pg, pos, size) : fn in existing, config)
+            fns = set([fn for (fn, _, _, _) in config ])
+            newfns = [ fn for fn in pdfs if fn not in fns ]
+            if newfns:
+                newconfig, _, nh = self.layout_grid(newfns, x, y + h)
+                config = config + newconfig
+                h += nh
+            self.add(path, config, (x, y, w, h))
+
+        # place new directories on shelves below everything else
+        if len(self) > 0:
+            startx = min(self.xs)
+            curx, cury = startx, max([ y+h for y, h in zip(self.ys, self.hs) ]) + REGION_SPACING
+        else:
+            startx = curx = cury = 0.0
+        rowh = 0.0
+        for path, pdfs in newdirs:
+            config, w, h = self.layout_grid(pdfs, curx, cury)
+            if curx > startx and curx + w > startx + REGION_ROW_WIDTH:
+                curx, cury, rowh = startx, cury + rowh + REGION_SPACING, 0.0
+                config, w, h = self.layout_grid(pdfs, curx, cury)
+            self.add(path, config, (curx, cury, w, h))
+            curx += w + REGION_SPACING
+            rowh = max(rowh, h)
+
+    def layout_grid(self, fns, x, y):
+        # pages are not opened here, so lay out cells of a nominal page size
+        pw, ph = NOMINAL_PAGE_SIZE
+        cols = max(1, int(math.ceil(math.sqrt(len(fns)))))
+        rows = (len(fns) + cols - 1) / cols
+        config = [ (fn, 0, (x + ENTITY_SPACING + (i % cols) * (pw + ENTITY_SPACING),
+                            y + ENTITY_SPACING + (i / cols) * (ph + ENTITY_SPACING)), None)
+                   for i, fn in enumerate(fns) ]
+        return config, ENTITY_SPACING + cols * (pw + ENTITY_SPACING), ENTITY_SPACING + rows * (ph + ENTITY_SPACING)
+
+    def set_config(self, region, config):
+        # grow the region to cover entities dragged outside of it
+        self.configs[region] = config
+        x, y = self.xs[region], self.ys[region]
+        ex, ey = x + self.ws[region], y + self.hs[region]
+        for (_, _, (px, py), size) in config:
+            pw, ph = size or NOMINAL_PAGE_SIZE
+            x, y = min(x, px), min(y, py)
+            ex, ey = max(ex, px + pw), max(ey, py + ph)
+        self.xs[region], self.ys[region] = x, y
+        self.ws[region], self.hs[region] = ex - x, ey - y
+
+    def get_intersecting(self, x, y, ex, ey):
+        return [ i for i, (rx, ry, rw, rh) in enumerate(zip(self.xs, self.ys, self.ws, self.hs))
+                 if rx < ex and rx+rw > x and ry < ey and ry+rh > y ]
+
+    def get_bounds(self):
+        return (min(self.xs), min(self.ys),
+                max([ x+w for x, w in zip(self.xs, self.ws) ]),
+                max([ y+h for y, h in zip(self.ys, self.hs) ]))
+
+    def save(self, camera):
+        saved = [ (path, config, (x, y, w, h))
+                  for path, config, x, y, w, h in zip(self.paths, self.configs, self.xs, self.ys, self.ws, self.hs) ]
+        f = open(os.path.join(self.root, ".pdf-desktop-index"), "w")
+        pickle.dump( (camera, saved), f)
+        f.close()
+
+def prerender_document((filename, scales)):
+
+    texturemgr = TextureManager(None, diskcache = True, writecache = True)
+    try:
+        doc = Poppler.Document.new_from_file("file://" + filename, None)
+    except Exception, e:
+        sys.stderr.write("%s: %s\n" % (filename, e))
+        return 0, 0
+    doc.filename = filename
+
+    # a page that fails is reported and skipped; an exception escaping
+    # here would abort the whole pool
+    pages = 0
+    for pagenum in xrange(doc.get_n_pages()):
+        for scale in scales:
+            try:
+                if texturemgr.is_uptodate_on_disk(doc, pagenum, scale): continue
+                texturemgr.load_texture(doc, pagenum, scale)
+                pages += 1
+            except Exception, e:
+                sys.stderr.write("%s page %d at %g: %s\n" % (filename, pagenum, scale, e))
+        texturemgr.drop_textures(doc, pagenum)
+    return pages, texturemgr.byteswritten
+
+def prerender(directory, scales = PRERENDER_SCALES):
+
+    # only the batch mode needs it, so the desktop doesn't pay for the import
+    import multiprocessing
+
+    tasks = []
+    for root, dirs, files in os.walk(os.path.abspath(directory)):
+        dirs[:] = [ d for d in dirs if d != CACHE_DIRNAME ]
+        for fn in sorted(files):
+            if fn.endswith(".pdf"):
+                tasks.append( (os.path.join(root, fn), scales) )
+
+    start = time()
+    pages, nbytes = 0, 0
+    pool = multiprocessing.Pool(multiprocessing.cpu_count())
+    for p, b in pool.imap_unordered(prerender_document, tasks):
+        pages += p
+        nbytes += b
+    pool.close()
+    pool.join()
+    elapsed = max(time() - start, 0.001)
+
+    print "%d documents, %d pages rendered in %.1fs (%.1f pages/s), %d bytes written" % \
+        (len(tasks), pages, elapsed, pages / elapsed, nbytes)
+
 if __name__ == "__main__":
+
+    if len(sys.argv) > 2 and sys.argv[1] == "--prerender":
+        scales = tuple(map(float, sys.argv[3:])) or PRERENDER_SCALES
+        prerender(sys.argv[2], scales)
+        sys.exit(0)
     
     GLib.threads_init()
     Clutter.threads_init()
     Clutter.init(sys.argv)
 
     Clutter.threads_enter()
+    args = sys.argv[1:]
+    recursive = "--recursive" in args
+    if recursive: args.remove("--recursive")
+    record, replay = None, None
+    if "--record" in args:
+        i = args.index("--record")
+        record = args[i+1]
+        del args[i:i+2]
+    if "--replay" in args:
+        i = args.index("--replay")
+        replay = args[i+1]
+        del args[i:i+2]
     directory = os.getcwd()
-    if len(sys.argv) > 1:
-        directory = sys.argv[1]
-    desktop = Desktop(directory)
+    if len(args) > 0:
+        directory = args[0]
+    desktop = Desktop(directory, recursive, record, replay)
     desktop.run()
     Clutter.threads_leave()
 